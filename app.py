@@ -1,15 +1,78 @@
+import os
+import re
+import time
+import hashlib
+from bisect import bisect_left, bisect_right
+from collections import ChainMap, namedtuple
+from functools import lru_cache
+from pathlib import Path
+from types import MappingProxyType
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3Error
+from urllib3.util.retry import Retry
 import pandas as pd
 import numpy as np
-import streamlit.components.v1 as components
 
-# --- SAFE IMPORT FOR GEMINI ---
+# --- SAFE IMPORT FOR ORJSON (faster decode, stdlib json as fallback) ---
 try:
-    import google.generativeai as genai
-    has_gemini_lib = True
+    import orjson
+    json_loads, json_dumps = orjson.loads, orjson.dumps
 except ImportError:
-    has_gemini_lib = False
+    import json
+    json_loads = json.loads
+    def json_dumps(obj): return json.dumps(obj).encode("utf-8")
+
+# --- SAFE IMPORT FOR NUMBA (JIT for the score kernel; plain NumPy without it) ---
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if args and callable(args[0]): return args[0]
+        return lambda fn: fn
+
+# --- DEFINE COLOR PALETTES (Material 3) ---
+# Read-only: theme_css() caches per theme across sessions and cards layer over these, so nothing may mutate them
+# Google Dark Mode Tokens
+DARK = MappingProxyType({
+    "bg": "#121212",
+    "surface": "#1E1E1E",
+    "surface_high": "#2C2C2C",
+    "on_surface": "#E3E3E3",
+    "on_surface_variant": "#C4C7C5",
+    "primary": "#8AB4F8", 
+    "border": "#444746",
+    "shadow": "0 4px 8px rgba(0,0,0,0.5)",
+    "success_bg": "rgba(129, 201, 149, 0.15)", # Green tint
+    "success_text": "#81C995",
+    "warning_bg": "rgba(253, 214, 99, 0.15)",
+    "warning_text": "#FDD663",
+    "error_bg": "rgba(242, 139, 130, 0.15)",
+    "error_text": "#F28B82",
+    "blue_bg": "rgba(138, 180, 248, 0.15)",
+    "blue_text": "#8AB4F8"
+})
+
+# Google Light Mode Tokens
+LIGHT = MappingProxyType({
+    "bg": "#FFFFFF",
+    "surface": "#FFFFFF",
+    "surface_high": "#F8F9FA",
+    "on_surface": "#1F1F1F",
+    "on_surface_variant": "#5F6368",
+    "primary": "#1A73E8",
+    "border": "#E0E0E0",
+    "shadow": "0 1px 3px rgba(0,0,0,0.08)",
+    "success_bg": "#E6F4EA",
+    "success_text": "#137333",
+    "warning_bg": "#FEF7E0",
+    "warning_text": "#B06000",
+    "error_bg": "#FCE8E6",
+    "error_text": "#C5221F",
+    "blue_bg": "#E8F0FE",
+    "blue_text": "#1967d2"
+})
 
 # --- PAGE CONFIG ---
 st.set_page_config(page_title="Compounder Formula (Pro)", page_icon="📊", layout="wide")
@@ -26,50 +89,19 @@ with st.sidebar:
     st.header("Settings")
     is_dark = st.toggle("Dark Mode", value=(st.session_state.theme == 'dark'), on_change=toggle_theme)
 
-# --- DEFINE COLOR PALETTES (Material 3) ---
-if st.session_state.theme == 'dark':
-    # Google Dark Mode Tokens
-    colors = {
-        "bg": "#121212",
-        "surface": "#1E1E1E",
-        "surface_high": "#2C2C2C",
-        "on_surface": "#E3E3E3",
-        "on_surface_variant": "#C4C7C5",
-        "primary": "#8AB4F8", 
-        "border": "#444746",
-        "shadow": "0 4px 8px rgba(0,0,0,0.5)",
-        "success_bg": "rgba(129, 201, 149, 0.15)", # Green tint
-        "success_text": "#81C995",
-        "warning_bg": "rgba(253, 214, 99, 0.15)",
-        "warning_text": "#FDD663",
-        "error_bg": "rgba(242, 139, 130, 0.15)",
-        "error_text": "#F28B82",
-        "blue_bg": "rgba(138, 180, 248, 0.15)",
-        "blue_text": "#8AB4F8"
-    }
-else:
-    # Google Light Mode Tokens
-    colors = {
-        "bg": "#FFFFFF",
-        "surface": "#FFFFFF",
-        "surface_high": "#F8F9FA",
-        "on_surface": "#1F1F1F",
-        "on_surface_variant": "#5F6368",
-        "primary": "#1A73E8",
-        "border": "#E0E0E0",
-        "shadow": "0 1px 3px rgba(0,0,0,0.08)",
-        "success_bg": "#E6F4EA",
-        "success_text": "#137333",
-        "warning_bg": "#FEF7E0",
-        "warning_text": "#B06000",
-        "error_bg": "#FCE8E6",
-        "error_text": "#C5221F",
-        "blue_bg": "#E8F0FE",
-        "blue_text": "#1967d2"
-    }
+colors = DARK if st.session_state.theme == 'dark' else LIGHT
 
 # --- INJECT DYNAMIC CSS ---
-st.markdown(f"""
+def _minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{}:;,>])\s*", r"\1", css).strip()
+
+@st.cache_resource
+def theme_css(theme):
+    """Theme stylesheet, formatted (and minified) once per theme instead of on every rerun."""
+    colors = DARK if theme == 'dark' else LIGHT
+    return _minify_css(f"""
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Roboto:wght@300;400;500;700&display=swap');
     
@@ -136,7 +168,9 @@ st.markdown(f"""
         border: 1px solid transparent;
     }}
 </style>
-""", unsafe_allow_html=True)
+""")
+
+st.markdown(theme_css(st.session_state.theme), unsafe_allow_html=True)
 
 st.title("📊 Compounder Dashboard")
 st.markdown("Analyze capital allocation efficiency with flexible timeframes.")
@@ -149,128 +183,283 @@ except (FileNotFoundError, KeyError):
     st.stop()
 
 # --- HELPER FUNCTIONS ---
-def format_currency(val):
-    if val is None or pd.isna(val): return "N/A"
+@lru_cache(maxsize=1024)
+def _format_currency(val):
     abs_val = abs(val)
     if abs_val >= 1e9: return f"${val/1e9:,.2f} B"
     if abs_val >= 1e6: return f"${val/1e6:,.2f} M"
     return f"${val:,.0f}"
 
-def smart_get(data_dict, keys_to_try):
-    for k in keys_to_try:
-        if k in data_dict: return data_dict[k]
-    return None
+def format_currency(val):
+    # NaN != NaN would miss on every lookup and fill the cache, so it never reaches it
+    if val is None or pd.isna(val): return "N/A"
+    return _format_currency(float(val))
+
+# QuickFS field names per metric, in priority order (first key present wins)
+METRIC_ALIASES = {
+    "OCF": ("cf_cfo", "cfo", "cash_flow_operating"),
+    "CapEx": ("capex", "capital_expenditures"),
+    "Liabilities": ("total_current_liabilities", "liabilities_current"),
+    "PPE": ("ppe_net", "net_property_plant_and_equipment"),
+    "Goodwill": ("goodwill",),
+    "Current Assets": ("total_current_assets", "current_assets"),
+}
+# Summed over the trailing 4 quarters for TTM; every other metric is a balance-sheet snapshot
+FLOW_METRICS = frozenset({"OCF", "CapEx"})
+DATE_KEYS = ("period_end_date", "fiscal_year")
+
+# Periods are int years; TTM sorts after every real year and is only shown as "TTM"
+TTM_PERIOD = 9999
+
+def period_label(period):
+    return "TTM" if period == TTM_PERIOD else str(period)
+
+def resolve_metrics(*blocks):
+    # One pass over the alias table resolves every block (annual + quarterly).
+    # Single .get per candidate (no `in` + [] double hash); a null field falls through to the next alias
+    out = tuple({} for _ in blocks)
+    for metric, aliases in METRIC_ALIASES.items():
+        for data_dict, resolved in zip(blocks, out):
+            v = None
+            for k in aliases:
+                v = data_dict.get(k)
+                if v is not None: break
+            resolved[metric] = v
+    return out
+
+@st.cache_resource
+def get_http_session():
+    # One pooled session per worker so repeat fetches reuse the TLS connection
+    session = requests.Session()
+    # raise_on_status=False: a 5xx that outlasts the retries comes back as a response for the
+    # "API Error" branch instead of a RetryError whose text embeds the URL (and its api_key)
+    # read=0: a stalled read fails after one read timeout instead of four; gateway 5xx are still retried
+    retry = Retry(total=3, read=0, backoff_factor=0.3, status_forcelist=[502, 503, 504], raise_on_status=False)
+    session.mount("https://", HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=retry))
+    session.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+    session.params = {"api_key": API_KEY}  # merged into every request by requests itself
+    return session
+
+# --- DISK CACHE (survives worker restarts; st.cache_data sits in front of it) ---
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "quickfs")
+# Same TTL as the in-memory st.cache_data tier in front of it, so a new filing shows up within the hour
+CACHE_TTL = 3600
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, hashlib.md5(key.encode()).hexdigest() + ".json")
+
+def disk_cache_get(key, ttl=CACHE_TTL):
+    path = _cache_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > ttl:
+            os.remove(path)  # stale entries are deleted, not just skipped
+            return None
+        with open(path, "rb") as f:
+            return json_loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def disk_cache_prune(ttl=CACHE_TTL):
+    # Sweep expired entries for tickers nobody asks for again; runs only on a cache write
+    cutoff = time.time() - ttl
+    try:
+        with os.scandir(CACHE_DIR) as it:
+            for entry in it:
+                try:
+                    if entry.stat().st_mtime < cutoff: os.remove(entry.path)
+                except OSError:
+                    pass  # raced with another worker's write/remove
+    except OSError:
+        pass
+
+def disk_cache_set(key, value):
+    path = _cache_path(key)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write-then-rename so a concurrent reader never sees a half-written file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json_dumps(value))
+        os.replace(tmp_path, path)
+    except OSError:
+        return  # caching is best-effort; a read-only filesystem just means no disk tier
+    disk_cache_prune()
+
+def disk_cache_clear(key):
+    try:
+        os.remove(_cache_path(key))
+    except OSError:
+        pass  # nothing cached (or not removable): the next fetch just overwrites it
 
-@st.cache_data(show_spinner=False)
+@st.cache_data(ttl=CACHE_TTL, max_entries=128, show_spinner=False)
 def fetch_quickfs_data(ticker):
+    cached = disk_cache_get(ticker)
+    if cached is not None: return cached, None
+    
     url = f"https://public-api.quickfs.net/v1/data/all-data/{ticker}"
-    params = {"api_key": API_KEY}
     try:
-        r = requests.get(url, params=params)
-        if r.status_code != 200: return None, f"API Error: {r.status_code}"
-        data = r.json()
-        if "data" not in data: return None, "Invalid data received."
-        return data["data"], None
-    except Exception as e:
-        return None, str(e)
+        # stream=True: headers first, body only if it is worth reading; `with` returns the connection to the pool
+        with get_http_session().get(url, timeout=(3, 10), stream=True) as r:  # (connect, read)
+            if r.status_code != 200: return None, f"API Error: {r.status_code}"
+            # Reject HTML error pages etc. before downloading or parsing them
+            if r.headers.get("content-type", "").split(";")[0].strip() != "application/json":
+                return None, "Invalid data received."
+            # Raw (gunzipped) bytes straight into the parser, no intermediate r.content copy
+            payload = json_loads(r.raw.read(decode_content=True))
+        data = payload.get("data") if isinstance(payload, dict) else None
+        if data is None: return None, "Invalid data received."
+        disk_cache_set(ticker, data)
+        return data, None
+    # Never surface str(e) here: connection/timeout errors quote the request URL, api_key included.
+    # Raw reads raise urllib3 errors directly, hence both families.
+    except (requests.RequestException, Urllib3Error):
+        return None, "Network error contacting QuickFS."
+    except ValueError:  # undecodable body (both JSON decoders raise ValueError subclasses)
+        return None, "Invalid data received."
+
+def _clean(values, n):
+    """Last n values as float64 with None/NaN -> 0; an absent series is all zeros."""
+    if not values: return np.zeros(n)
+    # Checked explicitly: on Python 3.12+ slices are hashable, so a dict-valued series would
+    # raise KeyError from values[-n:] and slip past process_financials' (TypeError, ValueError)
+    if not isinstance(values, list): raise TypeError(f"expected a series, got {type(values).__name__}")
+    # None coerces to NaN under dtype=float64, so one C pass does the fill
+    return np.nan_to_num(np.asarray(values[-n:], dtype=np.float64), nan=0.0)
+
+# Outcome of process_financials: the frames on success, or only an error message
+FinancialsResult = namedtuple("FinancialsResult", ["annual", "ttm", "error"])
 
 def process_financials(raw_data):
-    try:
-        annual = raw_data.get("financials", {}).get("annual", {})
-        quarterly = raw_data.get("financials", {}).get("quarterly", {})
-        
-        # --- ANNUAL KEYS ---
-        cfo_a = smart_get(annual, ["cf_cfo", "cfo", "cash_flow_operating"])
-        capex_a = smart_get(annual, ["capex", "capital_expenditures"])
-        liab_a = smart_get(annual, ["total_current_liabilities", "liabilities_current"])
-        
-        # ASSETS COMPONENTS
-        ca_a = smart_get(annual, ["total_current_assets", "current_assets"])
-        ppe_a = smart_get(annual, ["ppe_net", "net_property_plant_and_equipment"])
-        goodwill_a = smart_get(annual, ["goodwill"])
-        
-        dates_a = annual.get("period_end_date", annual.get("fiscal_year", []))
-        
-        if not cfo_a or not dates_a: return None, "Required annual metrics missing."
+    # Shape checks instead of a catch-all: real bugs should surface, bad payloads should not
+    financials = raw_data.get("financials") if isinstance(raw_data, dict) else None
+    annual = financials.get("annual") if isinstance(financials, dict) else None
+    if not isinstance(annual, dict): return FinancialsResult(None, None, "Required annual metrics missing.")
+    quarterly = financials.get("quarterly")
+    if not isinstance(quarterly, dict): quarterly = {}
+    
+    # First non-empty date field; map/filter keep the probe loop in C
+    dates_a = next(filter(None, map(annual.get, DATE_KEYS)), None)
+    # No annual date axis means nothing to chart: bail out before resolving any metric
+    if not dates_a: return FinancialsResult(None, None, "Required annual metrics missing.")
+    if not isinstance(dates_a, list): return FinancialsResult(None, None, "Malformed financial data: dates are not a series.")
+    
+    metrics_a, metrics_q = resolve_metrics(annual, quarterly)
+    
+    # --- ANNUAL KEYS ---
+    cfo_a = metrics_a["OCF"]
+    if not cfo_a: return FinancialsResult(None, None, "Required annual metrics missing.")
+    if not isinstance(cfo_a, list): return FinancialsResult(None, None, "Malformed financial data: operating cash flow is not a series.")
 
-        min_len = min(len(cfo_a), len(dates_a))
+    min_len = min(len(cfo_a), len(dates_a))
+    
+    # Only the numeric coercion can fail on a malformed payload (short series, non-numeric values, odd dates)
+    try:
+        # One consolidated float64 block, columns in METRIC_ALIASES order
+        arr = np.empty((min_len, len(METRIC_ALIASES)), dtype=np.float64)
+        for j, metric in enumerate(METRIC_ALIASES):
+            arr[:, j] = _clean(metrics_a[metric], min_len)
+        arr[:, 0] = cfo_a[-min_len:]  # OCF keeps missing years as NaN
         
-        # Helper to align array lengths
-        def slice_and_fill(arr, length):
-            if not arr: return [0] * length
-            s = arr[-length:]
-            return [x if x is not None else 0 for x in s]
-
-        ppe_sliced = slice_and_fill(ppe_a, min_len)
-        gw_sliced = slice_and_fill(goodwill_a, min_len)
-        ca_sliced = slice_and_fill(ca_a, min_len)
-        liab_sliced = slice_and_fill(liab_a, min_len)
-
-        df_annual = pd.DataFrame({
-            "OCF": cfo_a[-min_len:],
-            "CapEx": slice_and_fill(capex_a, min_len),
-            "Liabilities": liab_sliced,
-            "PPE": ppe_sliced,
-            "Goodwill": gw_sliced,
-            "Current Assets": ca_sliced
-        })
-        df_annual.index = [str(d).split('-')[0] for d in dates_a[-min_len:]]
+        # Year label = text before the first '-' (also handles bare fiscal_year ints), split in C
+        years = np.char.partition(np.asarray(dates_a[-min_len:], dtype="U10"), "-")[:, 0].astype(np.int16)
         
         # --- QUARTERLY / TTM KEYS ---
         df_ttm = None
-        cfo_q = smart_get(quarterly, ["cf_cfo", "cfo", "cash_flow_operating"])
-        capex_q = smart_get(quarterly, ["capex", "capital_expenditures"])
-        
-        # Balance Sheet Items (Stock)
-        liab_q = smart_get(quarterly, ["total_current_liabilities", "liabilities_current"])
-        ca_q = smart_get(quarterly, ["total_current_assets", "current_assets"])
-        ppe_q = smart_get(quarterly, ["ppe_net", "net_property_plant_and_equipment"])
-        goodwill_q = smart_get(quarterly, ["goodwill"])
+        cfo_q = metrics_q["OCF"]
         
         if cfo_q and len(cfo_q) >= 4:
-            # Flow items (sum 4 quarters)
-            ttm_ocf = sum(cfo_q[-4:])
-            ttm_capex = sum(capex_q[-4:]) if capex_q else 0
-            
-            # Stock items (most recent quarter)
-            ttm_liab = liab_q[-1] if liab_q else 0
-            ttm_ca = ca_q[-1] if ca_q else 0
-            ttm_ppe = ppe_q[-1] if ppe_q and ppe_q[-1] is not None else 0
-            ttm_gw = goodwill_q[-1] if goodwill_q and goodwill_q[-1] is not None else 0
-            
-            df_ttm = pd.DataFrame({
-                "OCF": [ttm_ocf], 
-                "CapEx": [ttm_capex], 
-                "Liabilities": [ttm_liab],
-                "Current Assets": [ttm_ca],
-                "PPE": [ttm_ppe],
-                "Goodwill": [ttm_gw]
-            }, index=["TTM"])
-
-        return df_annual, df_ttm
-    except Exception as e:
-        return None, str(e)
+            # Flow items sum the last 4 quarters, stock items take the most recent one;
+            # _clean turns null quarters into 0, so no per-item None ternaries
+            row = [_clean(metrics_q[m], 4 if m in FLOW_METRICS else 1).sum() for m in METRIC_ALIASES]
+            # Same column order as df_annual so the TTM row can be appended positionally
+            df_ttm = pd.DataFrame([row], columns=list(METRIC_ALIASES), index=pd.Index(np.array([TTM_PERIOD], dtype=np.int16), name="Year"), dtype=np.float64)
+    except (TypeError, ValueError) as e:
+        return FinancialsResult(None, None, f"Malformed financial data: {e}")
+
+    df_annual = pd.DataFrame(arr, columns=list(METRIC_ALIASES), index=pd.Index(years, name="Year"))
+    # Sorted integer index: numeric ordering and bisect-based positional slices
+    df_annual.sort_index(inplace=True)
+
+    return FinancialsResult(df_annual, df_ttm, None)
+
+@njit(cache=True)
+def derive_fcf_ic(ocf, capex, liab, ppe, gw, ca):
+    # One fresh buffer per output, then in-place ufuncs: no intermediate temporaries
+    fcf = np.abs(capex)
+    np.subtract(ocf, fcf, fcf)
+    # Invested Capital Definition: (Current Assets - Liabilities) + PPE + Goodwill
+    ic = ca - liab
+    ic += ppe
+    ic += gw
+    return fcf, ic
+
+@njit(cache=True)
+def compounder_kernel(fcf, ic):
+    # No fastmath: nansum has to see the NaNs of missing OCF years
+    A1 = np.nansum(fcf)
+    B1 = fcf[-1] - fcf[0]
+    A2 = ic[-1] - ic[0]
+    roiic = B1 / A2 if A2 != 0 else 0.0
+    reinvest = A2 / A1 if A1 != 0 else 0.0
+    return A1, B1, A2, roiic, reinvest, roiic * reinvest
+
+@st.cache_resource
+def warm_kernel():
+    # Throwaway calls so the first ticker doesn't pay the JIT compile (or on-disk cache load)
+    z = np.zeros(2)
+    derive_fcf_ic(z, z, z, z, z, z)
+    compounder_kernel(z, z)
+
+warm_kernel()
+
+def build_full_series(df_annual, df_ttm):
+    """Annual rows plus the TTM row (if any) and the derived FCF/IC columns, built once per load."""
+    # Single-row append: stack the raw arrays instead of pd.concat
+    if df_ttm is None:
+        base, index = df_annual.to_numpy(), df_annual.index
+    else:
+        base = np.vstack([df_annual.to_numpy(), df_ttm[df_annual.columns].to_numpy()])
+        index = df_annual.index.append(df_ttm.index)
+    # Columns are in METRIC_ALIASES order, which is the kernel's argument order
+    fcf, ic = derive_fcf_ic(*np.ascontiguousarray(base.T))
+    return pd.DataFrame(
+        np.column_stack([base, fcf, ic]),
+        columns=[*df_annual.columns, "FCF", "IC"],
+        index=index,
+    )
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=128, show_spinner=False)
+def get_financials(ticker):
+    """Fetch + process, memoized on the ticker string so a repeat load skips the parsing too.
+
+    Returns a plain (full, meta, error) tuple: st.cache_data pickles the result, and a
+    class defined in this script can't be resolved from the fresh __main__ of a fragment rerun.
+    """
+    raw, error = fetch_quickfs_data(ticker)
+    if error: return None, {}, error
+    res = process_financials(raw)
+    if res.error: return None, {}, res.error
+    return build_full_series(res.annual, res.ttm), raw.get("metadata", {}), None
 
 # --- CUSTOM HTML CARD RENDERER ---
-def render_custom_card(title, value, target, description):
-    return f"""
+CARD_TEMPLATE = """
     <div style="
-        background-color: {colors['surface']};
-        border: 1px solid {colors['border']};
+        background-color: {surface};
+        border: 1px solid {border};
         border-radius: 12px;
         padding: 20px;
         height: 100%;
         display: flex;
         flex-direction: column;
         justify-content: space-between;
-        box-shadow: {colors['shadow']};
+        box-shadow: {shadow};
     ">
         <div>
             <div style="
                 text-transform: uppercase;
                 font-size: 0.8rem;
                 font-weight: 700;
-                color: {colors['on_surface_variant']};
+                color: {on_surface_variant};
                 margin-bottom: 8px;
                 letter-spacing: 0.5px;
             ">
@@ -279,15 +468,15 @@ def render_custom_card(title, value, target, description):
             <div style="
                 font-size: 2.2rem;
                 font-weight: 700;
-                color: {colors['primary']};
+                color: {primary};
                 margin-bottom: 12px;
             ">
                 {value}
             </div>
             <div style="margin-bottom: 15px;">
                 <span style="
-                    background-color: {colors['success_bg']};
-                    color: {colors['success_text']};
+                    background-color: {success_bg};
+                    color: {success_text};
                     padding: 6px 12px;
                     border-radius: 16px;
                     font-size: 0.85rem;
@@ -299,534 +488,142 @@ def render_custom_card(title, value, target, description):
         </div>
         <div style="
             font-size: 0.85rem;
-            color: {colors['on_surface_variant']};
+            color: {on_surface_variant};
             line-height: 1.4;
             padding-top: 12px;
-            border-top: 1px solid {colors['border']};
+            border-top: 1px solid {border};
         ">
             {description}
         </div>
     </div>
     """
 
-# --- INFOGRAPHIC HTML ---
-html_guide = """
-<!doctype html>
-<html lang="en">
-<head>
-  <meta charset="utf-8" />
-  <meta name="viewport" content="width=device-width, initial-scale=1" />
-  <style>
-    :root{
-      /* --- Material 3 Expressive-inspired tokens --- */
-      --primary:#1a73e8; --on-primary:#ffffff; --primary-container:#e8f0fe;
-      --secondary:#34a853; --secondary-container:rgba(52,168,83,.14);
-      --tertiary:#fbbc04; --tertiary-container:rgba(251,188,4,.18);
-      --error:#ea4335; --outline:rgba(31,31,31,.14);
-      --surface:#ffffff; --surface-1:#fbfbfb;
-      --surface-container-low:#f5f7fb; --surface-container:#f1f3f4;
-      --surface-container-high:#e9eef6;
-      --on-surface:#1f1f1f; --on-surface-variant:#5f6368;
-      --shadow-1: 0 1px 2px rgba(0,0,0,.06), 0 2px 10px rgba(0,0,0,.06);
-      --shadow-2: 0 6px 18px rgba(0,0,0,.10), 0 2px 6px rgba(0,0,0,.08);
-      --r-xl: 28px; --r-lg: 22px; --r-md: 18px; --r-sm: 14px;
-      font-size: 16px;
-    }
-    *{ box-sizing:border-box; }
-    body{
-      margin:0;
-      background: #ffffff; /* FORCE WHITE BACKGROUND */
-      color: var(--on-surface);
-      font-family: Roboto, "Google Sans", sans-serif;
-      font-size: 1rem; line-height: 1.45;
-    }
-    .page{ max-width: 1140px; margin: 0 auto; padding: 1.25rem 1.1rem 3rem; }
-    
-    .hero{
-      position: relative; overflow: hidden; border-radius: var(--r-xl);
-      border: 1px solid var(--outline);
-      background: linear-gradient(135deg, rgba(26,115,232,.10), rgba(52,168,83,.08) 48%, rgba(251,188,4,.10));
-      box-shadow: var(--shadow-2); padding: 1.35rem 1.35rem 1.2rem;
-    }
-    .title{ display:flex; gap: 1rem; align-items:flex-start; min-width: 0; }
-    .mark{
-      width: 54px; height: 54px; border-radius: 18px; background: var(--surface);
-      border: 1px solid rgba(26,115,232,.18); box-shadow: var(--shadow-1);
-      display:grid; place-items:center; flex: 0 0 auto;
-    }
-    h1{ margin:0; font-size: 2.25rem; font-weight: 800; letter-spacing: .2px; }
-    .subtitle{ margin:.35rem 0 0; font-size: 1.05rem; color: rgba(31,31,31,.74); }
-    .grid{ display:grid; gap: 1rem; margin-top: 1rem; }
-    .card{
-      border-radius: var(--r-xl); border: 1px solid var(--outline);
-      background: rgba(255,255,255,.86); box-shadow: var(--shadow-1);
-      padding: 1.15rem 1.15rem 1.05rem; position: relative; overflow:hidden;
-    }
-    .card:before{
-      content:""; position:absolute; inset:-2px auto auto -2px; width: 10px; height: 100%;
-      background: linear-gradient(180deg, rgba(26,115,232,.95), rgba(52,168,83,.75), rgba(251,188,4,.75));
-      border-top-left-radius: var(--r-xl); border-bottom-left-radius: var(--r-xl); opacity: .85;
-    }
-    .card-header{ display:flex; gap: .85rem; align-items:flex-start; margin-bottom: .8rem; }
-    .step{
-      width: 40px; height: 40px; border-radius: 14px; background: var(--primary-container);
-      border: 1px solid rgba(26,115,232,.18); display:grid; place-items:center;
-      font-weight: 900; color: #174ea6; font-size: 1rem; flex: 0 0 auto;
-    }
-    h2{ margin: .1rem 0 0; font-size: 1.35rem; font-weight: 800; letter-spacing: .2px; }
-    ul{ margin: .2rem 0 0 1.1rem; padding:0; font-size: 1rem; color: var(--on-surface); }
-    li{ margin:.35rem 0; }
-    .muted{ margin:.2rem 0 0; color: var(--on-surface-variant); font-size: 1rem; }
-    
-    /* --- STACKED DEFINITION TILES --- */
-    .two-col{ display:grid; grid-template-columns: 1fr; gap: 1rem; } /* STACKED VERTICALLY */
-    
-    .tile{
-      border-radius: var(--r-lg); border: 1px solid rgba(31,31,31,.10);
-      background: var(--surface-container); padding: 1rem; position: relative; overflow:hidden;
-    }
-    .tile h3{ margin:0 0 .5rem; font-size: 1.15rem; font-weight: 800; position: relative; z-index: 1; }
-    .formula{
-      font-family: ui-monospace, monospace; font-size: .75rem; padding: .65rem .75rem;
-      border-radius: var(--r-md); border: 1px solid rgba(31,31,31,.14);
-      background: rgba(255,255,255,.9); position: relative; z-index: 1;
-      overflow-x:auto; white-space: nowrap;
-    }
-    .ratio-grid, .score-grid{ display:grid; gap: 1rem; align-items: stretch; }
-    .ratio-grid { grid-template-columns: 1fr 1fr; }
-    .score-grid { grid-template-columns: 1.1fr .9fr; }
-    @media (max-width: 980px){ .ratio-grid, .score-grid, .two-col{ grid-template-columns: 1fr; } }
-    .panel{
-      border-radius: var(--r-lg); border: 1px solid rgba(31,31,31,.12);
-      background: var(--surface-container-low); padding: 1rem; position: relative; overflow:hidden;
-    }
-    .panel h3{ margin:0; font-size: 1.15rem; font-weight: 900; }
-    .panel p{ margin: .5rem 0 0; font-size: 1rem; color: rgba(31,31,31,.82); }
-    .footer{
-      border-radius: var(--r-xl); border: 1px solid var(--outline);
-      background: rgba(255,255,255,.86); box-shadow: var(--shadow-1);
-      padding: 1rem 1.15rem; color: rgba(31,31,31,.72); font-size: 1rem;
-    }
-    
-    .meter{
-      margin-top: .9rem;
-      border-radius: var(--r-lg);
-      border: 1px solid rgba(31,31,31,.12);
-      background: rgba(255,255,255,.78);
-      padding: .85rem;
-    }
-    .mini-note{
-      margin:.55rem 0 0;
-      font-size: 1rem;
-      color: rgba(31,31,31,.64);
-    }
-    .cat-grid{
-      display:grid;
-      grid-template-columns: 1fr;
-      gap: .75rem;
-      margin-top: .85rem;
-    }
-    .cat{
-      border-radius: var(--r-lg);
-      border: 1px solid rgba(31,31,31,.12);
-      background: rgba(255,255,255,.78);
-      box-shadow: var(--shadow-1);
-      padding: .85rem .95rem;
-      display:grid;
-      grid-template-columns: 18px 1fr;
-      gap: .85rem;
-      align-items: center;
-    }
-    .cat .sw{
-      width: 16px; height: 16px;
-      border-radius: 999px;
-      border: 1px solid rgba(31,31,31,.16);
-      margin-top: .15rem;
-    }
-    .cat h4{ display:inline; margin: 0; font-size: 1.1rem; font-weight: 950; color: rgba(31,31,31,.86); }
-    .cat .thr{ display:inline; margin: 0 0 0 .5rem; font-size: 1rem; font-weight: 950; color: rgba(31,31,31,.80); }
-    .cat .desc{ margin: .25rem 0 0; font-size: 1rem; color: rgba(31,31,31,.70); line-height: 1.35; grid-column: 2; }
-
-    .ratio-footer{
-      margin-top: .9rem;
-      padding-top: .85rem;
-      border-top: 1px dashed rgba(31,31,31,.16);
-      display:grid;
-      grid-template-columns: 1fr 1fr;
-      gap: .75rem;
-      color: rgba(31,31,31,.68);
-      font-size: 1rem;
-    }
-    @media (max-width: 980px){
-      .ratio-footer{ grid-template-columns: 1fr; }
-    }
-  </style>
-</head>
-
-<body>
-  <div class="page">
-    <section class="hero">
-      <div class="top">
-        <div class="title">
-          <div class="mark" aria-hidden="true">
-            <svg width="26" height="26" viewBox="0 0 24 24" fill="none">
-              <path d="M4 18V6" stroke="#1a73e8" stroke-width="1.5" stroke-linecap="round"/>
-              <path d="M4 18H20" stroke="#1a73e8" stroke-width="1.5" stroke-linecap="round"/>
-              <path d="M7 15l4-5 3 3 4-6" stroke="#34a853" stroke-width="1.5" stroke-linecap="round" stroke-linejoin="round"/>
-            </svg>
-          </div>
-          <div>
-            <h1>The Compounder Formula</h1>
-            <p class="subtitle">A framework to identify businesses that grow cash and reinvest it at high returns.</p>
-          </div>
-        </div>
-      </div>
-    </section>
-
-    <div class="grid">
-
-      <section class="card">
-        <div class="card-header">
-          <div class="step">1</div>
-          <div>
-            <h2>What Is a Compounder?</h2>
-          </div>
-        </div>
-        <ul>
-          <li>Generates significant free cash flow.</li>
-          <li>Reinvests that cash at high rates of return.</li>
-          <li><strong>Outcome:</strong> Rising intrinsic value and shareholder wealth over long periods.</li>
-        </ul>
-      </section>
-
-      <section class="card">
-        <div class="card-header">
-          <div class="step">2</div>
-          <div>
-            <h2>Key Inputs (Definitions)</h2>
-          </div>
-        </div>
-
-        <div class="two-col">
-          <div class="tile">
-            <h3>Free Cash Flow (FCF)</h3>
-            <div class="formula">FCF = Operating Cash Flow − CapEx</div>
-            <p class="muted"><strong>Meaning:</strong> Cash left after maintaining and growing assets.</p>
-          </div>
-
-          <div class="tile">
-            <h3>Invested Capital (IC)</h3>
-            <div class="formula">IC = (Total Current Assets - Total Current Liabilities) + PPE_net + Goodwill</div>
-            <p class="muted"><strong>Meaning:</strong> Working Capital plus Tangible and Acquired Assets.</p>
-          </div>
-        </div>
-      </section>
-
-      <section class="card">
-        <div class="card-header">
-          <div class="step">3</div>
-          <div>
-            <h2>10-Year Setup (Timeline)</h2>
-            <p class="muted">Track start/end values over 10 years, then compute A1, B1, and A2.</p>
-          </div>
-        </div>
-
-        <div class="media" aria-label="10-year timeline with start/end labels for FCF and IC">
-          <svg viewBox="0 0 980 260" width="100%" height="auto" role="img">
-            <defs>
-              <linearGradient id="bar" x1="0" x2="1">
-                <stop offset="0" stop-color="#1a73e8" stop-opacity=".80"/>
-                <stop offset="0.55" stop-color="#34a853" stop-opacity=".70"/>
-                <stop offset="1" stop-color="#fbbc04" stop-opacity=".78"/>
-              </linearGradient>
-            </defs>
-
-            <rect x="80" y="72" width="820" height="18" rx="9" fill="url(#bar)"/>
-            <line x1="80" y1="60" x2="80" y2="104" stroke="rgba(31,31,31,.35)" stroke-width="2"/>
-            <line x1="900" y1="60" x2="900" y2="104" stroke="rgba(31,31,31,.35)" stroke-width="2"/>
-
-            <text x="80" y="44" fill="rgba(31,31,31,.74)" font-size="16" font-weight="800">Year 0</text>
-            <text x="900" y="44" fill="rgba(31,31,31,.74)" font-size="16" font-weight="800" text-anchor="end">Year 10</text>
-
-            <g>
-              <rect x="80.5" y="118" width="340" height="46" rx="18" fill="#ffffff" stroke="rgba(31,31,31,.16)"/>
-              <text x="104.5" y="147" fill="#1f1f1f" font-size="16" font-weight="800">
-                FCF<tspan baseline-shift="sub" font-size="16">start</tspan>  •  IC<tspan baseline-shift="sub" font-size="16">start</tspan>
-              </text>
-            </g>
-
-            <g>
-              <rect x="559.5" y="118" width="340" height="46" rx="18" fill="#ffffff" stroke="rgba(31,31,31,.16)"/>
-              <text x="883.5" y="147" fill="#1f1f1f" font-size="16" font-weight="800" text-anchor="end">
-                FCF<tspan baseline-shift="sub" font-size="16">end</tspan>  •  IC<tspan baseline-shift="sub" font-size="16">end</tspan>
-              </text>
-            </g>
-
-            <g>
-              <g>
-                <rect x="88" y="182" width="258" height="62" rx="18" fill="#f1f3f4" stroke="rgba(31,31,31,.16)"/>
-                <text x="108" y="210" fill="#1f1f1f" font-size="16" font-weight="900">A1:</text>
-                <text x="150" y="210" fill="rgba(31,31,31,.82)" font-size="16" font-weight="700">Accumulated FCF</text>
-                <text x="108" y="230" fill="rgba(31,31,31,.70)" font-size="16" font-weight="600">(sum over 10 years)</text>
-              </g>
-
-              <g>
-                <rect x="360" y="182" width="258" height="62" rx="18" fill="#f1f3f4" stroke="rgba(31,31,31,.16)"/>
-                <text x="378.5" y="210" fill="#1f1f1f" font-size="16" font-weight="900">B1:</text>
-                <text x="420.5" y="210" fill="rgba(31,31,31,.82)" font-size="16" font-weight="700">Δ FCF</text>
-                <text x="378.5" y="230" fill="rgba(31,31,31,.70)" font-size="16" font-weight="600">
-                  = FCF<tspan baseline-shift="sub" font-size="16">end</tspan> − FCF<tspan baseline-shift="sub" font-size="16">start</tspan>
-                </text>
-              </g>
-
-              <g>
-                <rect x="632" y="182" width="268" height="62" rx="18" fill="#f1f3f4" stroke="rgba(31,31,31,.16)"/>
-                <text x="650" y="210" fill="#1f1f1f" font-size="16" font-weight="900">A2:</text>
-                <text x="692" y="210" fill="rgba(31,31,31,.82)" font-size="16" font-weight="700">Δ IC</text>
-                <text x="650" y="230" fill="rgba(31,31,31,.70)" font-size="16" font-weight="600">
-                  = IC<tspan baseline-shift="sub" font-size="16">end</tspan> − IC<tspan baseline-shift="sub" font-size="16">start</tspan>
-                </text>
-              </g>
-            </g>
-          </svg>
-        </div>
-      </section>
-
-      <section class="card" id="core-ratios">
-        <div class="card-header">
-          <div class="step">4</div>
-          <div>
-            <h2>Two Core Ratios</h2>
-            <p class="muted">Efficiency (ROIIC) × Opportunity (Reinvestment Rate)</p>
-          </div>
-        </div>
-
-        <div class="ratio-grid">
-          <div class="panel">
-            <div class="kicker">
-              <div class="icon" aria-hidden="true">
-                <svg width="18" height="18" viewBox="0 0 24 24" fill="none">
-                  <path d="M4 18V6" stroke="#1a73e8" stroke-width="1.25" stroke-linecap="round"/>
-                  <path d="M4 18H20" stroke="#1a73e8" stroke-width="1.25" stroke-linecap="round"/>
-                  <path d="M7 15l4-5 3 3 4-6" stroke="#1a73e8" stroke-width="1.25" stroke-linecap="round" stroke-linejoin="round"/>
-                </svg>
-              </div>
-              <h3>ROIIC (Efficiency)</h3>
-            </div>
-
-            <div class="formula">ROIIC = B1 ÷ A2</div>
-
-            <div class="meter" aria-label="ROIIC moat meter (rule-of-thumb band)">
-              <svg viewBox="0 0 920 120" width="100%" height="auto" role="img">
-                <rect x="60" y="52" width="800" height="22" rx="11" fill="#f1f3f4" stroke="rgba(31,31,31,.16)"/>
-                <rect x="60"  y="52" width="320" height="22" rx="11" fill="rgba(31,31,31,.06)"/>
-                <rect x="380" y="52" width="240" height="22" fill="rgba(26,115,232,.16)"/>
-                <rect x="620" y="52" width="240" height="22" rx="11" fill="rgba(26,115,232,.28)"/>
-
-                <line x1="540" y1="40" x2="540" y2="92" stroke="rgba(26,115,232,.85)" stroke-width="3" stroke-linecap="round"/>
-                <circle cx="540" cy="52" r="6" fill="#1a73e8" opacity=".85"/>
-
-                <text x="60" y="28" fill="rgba(31,31,31,.74)" font-size="16" font-weight="800">0%</text>
-                <text x="380" y="28" fill="rgba(31,31,31,.74)" font-size="16" font-weight="800">10%</text>
-                <text x="620" y="28" fill="rgba(31,31,31,.74)" font-size="16" font-weight="800">20%</text>
-                <text x="860" y="28" fill="rgba(31,31,31,.74)" font-size="16" font-weight="800" text-anchor="end">30%+</text>
-
-                <text x="220" y="104" text-anchor="middle" fill="rgba(31,31,31,.62)" font-size="16" font-weight="700">Weak</text>
-                <text x="500" y="104" text-anchor="middle" fill="rgba(31,31,31,.62)" font-size="16" font-weight="700">OK</text>
-                <text x="740" y="104" text-anchor="middle" fill="rgba(31,31,31,.62)" font-size="16" font-weight="700">Strong</text>
-              </svg>
-              <p class="mini-note">“Moat strength” check — higher is better.</p>
-            </div>
-
-            <p><strong>Rule of thumb:</strong> <span class="strong">&gt;15–20%</span> = strong moat.</p>
-            <p><strong>Question:</strong> “For each 1 of new capital, how much new annual FCF?”</p>
-          </div>
-
-          <div class="panel">
-            <div class="kicker">
-              <div class="icon" aria-hidden="true" style="background: rgba(52,168,83,.12); border-color: rgba(52,168,83,.20);">
-                <svg width="18" height="18" viewBox="0 0 24 24" fill="none">
-                  <path d="M12 3v18" stroke="#34a853" stroke-width="1.25" stroke-linecap="round"/>
-                  <path d="M7 8l5-5 5 5" stroke="#34a853" stroke-width="1.25" stroke-linecap="round" stroke-linejoin="round"/>
-                  <path d="M7 16h10" stroke="#34a853" stroke-width="1.25" stroke-linecap="round"/>
-                </svg>
-              </div>
-              <h3>Reinvestment Rate (Opportunity)</h3>
-            </div>
-
-            <div class="formula">Reinvestment Rate = A2 ÷ A1</div>
-
-            <div class="cat-grid">
-              <div class="cat">
-                <span class="sw" style="background: rgba(251,188,4,.70)"></span>
-                <div>
-                  <h4>Extreme</h4><div class="thr">&gt;100%</div>
-                  <div class="desc">Funded with external capital (debt)</div>
-                </div>
-              </div>
-              <div class="cat">
-                <span class="sw" style="background: rgba(52,168,83,.55)"></span>
-                <div>
-                  <h4>High</h4><div class="thr">&gt;80–100%</div>
-                  <div class="desc">Aggressive compounder</div>
-                </div>
-              </div>
-              <div class="cat">
-                <span class="sw" style="background: rgba(26,115,232,.55)"></span>
-                <div>
-                  <h4>Low</h4><div class="thr">&lt;20%</div>
-                  <div class="desc">Cash cow</div>
-                </div>
-              </div>
-            </div>
-          </div>
-        </div>
-
-        <div class="ratio-footer">
-          <div><strong>ROIIC</strong> answers: “How productive is new capital?” (moat)</div>
-          <div><strong>Reinvestment Rate</strong> answers: “How much cash gets reinvested?” (runway)</div>
-        </div>
-      </section>
-
-      <section class="card">
-        <div class="card-header">
-          <div class="step">5</div>
-          <div>
-            <h2>Final Compounder Score</h2>
-            <p class="muted">A quick proxy for sustainable intrinsic value growth.</p>
-          </div>
-        </div>
+def render_custom_card(title, value, target, description):
+    # ChainMap layers the card fields over the active palette without copying it
+    return CARD_TEMPLATE.format_map(ChainMap({"title": title, "value": value, "target": target, "description": description}, colors))
+
+# --- RESULTS TEMPLATES (parsed once; filled per rerun with format_map) ---
+RESULTS_TABLE_TEMPLATE = """
+<table>
+    <thead><tr><th>Metric</th><th>Value</th><th>Formula</th><th>Label</th></tr></thead>
+    <tbody>
+        <tr><td><b>Accumulated FCF</b></td><td>{A1}</td><td>∑ FCF</td><td><b>A1</b></td></tr>
+        <tr><td><b>Increase in FCF</b></td><td>{B1}</td><td>FCF<sub>end</sub> - FCF<sub>start</sub></td><td><b>B1</b></td></tr>
+        <tr><td><b>Increase in IC</b></td><td>{A2}</td><td>IC<sub>end</sub> - IC<sub>start</sub></td><td><b>A2</b></td></tr>
+        <tr><td><b>ROIIC</b></td><td>{roiic}</td><td>B1 / A2</td><td><b>C1</b></td></tr>
+        <tr><td><b>Reinvestment Rate</b></td><td>{reinvest}</td><td>A2 / A1</td><td><b>C2</b></td></tr>
+        <tr style="background-color:{surface_high}"><td><b>Final Score</b></td><td>{score}</td><td>C1 × C2</td><td><b>Result</b></td></tr>
+    </tbody>
+</table>
+"""
 
-        <div class="score-grid">
-          <div class="panel" style="background: var(--surface-container);">
-            <div class="formula">Score = ROIIC × Reinvestment Rate</div>
-            <p><strong>Interpretation:</strong> Approximate sustainable growth rate of intrinsic value.</p>
-            <p class="muted">High ROIIC (moat) + high reinvestment (runway) → the best long-term compounders.</p>
-          </div>
-
-          <div class="media" aria-label="2D grid with ROIIC (y) and reinvestment rate (x), highlighting elite quadrant">
-            <svg viewBox="0 0 520 380" width="100%" height="auto" role="img">
-              <rect x="70" y="40" width="400" height="270" fill="#ffffff" stroke="rgba(31,31,31,.16)" rx="18"/>
-              <line x1="270" y1="40" x2="270" y2="310" stroke="rgba(31,31,31,.12)" stroke-width="2"/>
-              <line x1="70" y1="175" x2="470" y2="175" stroke="rgba(31,31,31,.12)" stroke-width="2"/>
-              <line x1="70" y1="310" x2="470" y2="310" stroke="rgba(31,31,31,.35)" stroke-width="2"/>
-              <line x1="70" y1="40" x2="70" y2="310" stroke="rgba(31,31,31,.35)" stroke-width="2"/>
-              <rect x="270" y="40" width="200" height="135" fill="rgba(26,115,232,.10)" stroke="rgba(26,115,232,.30)" rx="18"/>
-              <text x="370" y="112" text-anchor="middle" fill="#174ea6" font-size="16" font-weight="900">Elite</text>
-              <text x="370" y="136" text-anchor="middle" fill="#174ea6" font-size="16" font-weight="900">Compounders</text>
-              <text x="170" y="120" text-anchor="middle" fill="rgba(31,31,31,.82)" font-size="16" font-weight="800">High ROIIC</text>
-              <text x="170" y="250" text-anchor="middle" fill="rgba(31,31,31,.82)" font-size="16" font-weight="800">Low / Low</text>
-              <text x="370" y="250" text-anchor="middle" fill="rgba(31,31,31,.82)" font-size="16" font-weight="800">High Reinvest</text>
-              <text x="270" y="350" text-anchor="middle" fill="rgba(31,31,31,.82)" font-size="16" font-weight="800">
-                Reinvestment Rate (low → high)
-              </text>
-              <g transform="translate(22,190) rotate(-90)">
-                <text x="0" y="0" text-anchor="middle" fill="rgba(31,31,31,.82)" font-size="16" font-weight="800">
-                  ROIIC (low → high)
-                </text>
-              </g>
-            </svg>
-          </div>
-        </div>
-      </section>
+VERDICT_TEMPLATE = """
+<div class="verdict-box" style="background-color:{bg}; border-color:{bg};">
+    <span style="font-size:1.2rem;">🧬</span>
+    <span style="color:{color}; font-weight:700;">Phase: {text}</span>
+</div>
+"""
 
-      <section class="footer">
-        Tip: Use 10-year averages to smooth cycles and reduce one-off noise — compounders reveal themselves over time.
-      </section>
+# Reinvestment-rate phases: [..0.20) [0.20..0.80) [0.80..1.00] (1.00..]
+# bisect_right on these bounds; the last one sits just above 1.00 so exactly 100% stays "Aggressive"
+VERDICT_BOUNDS = (0.20, 0.80, float(np.nextafter(1.0, 2.0)))
+VERDICTS = (
+    ("Cash Cow", "warning_bg", "warning_text"),
+    ("Moderate Reinvestment", "blue_bg", "blue_text"),
+    ("Aggressive Compounder", "success_bg", "success_text"),
+    ("External Funding (>100%)", "error_bg", "error_text"),
+)
 
-    </div>
-  </div>
-</body>
-</html>
-"""
+# --- INFOGRAPHIC HTML ---
+@st.cache_resource
+def load_guide():
+    # Static asset shared by every session; read from disk once per worker
+    return (Path(__file__).parent / "assets" / "compounder_guide.html").read_text(encoding="utf-8")
 
 # --- APP LOGIC ---
 
-col_input, col_btn = st.columns([3, 1])
+col_input, col_btn, col_refresh = st.columns([3, 1, 1])
 with col_input:
     ticker = st.text_input("Ticker", "APG:US", label_visibility="collapsed", placeholder="Enter Ticker (e.g. APG:US)").strip().upper()
 with col_btn:
     load_btn = st.button("Load Financials", type="primary", use_container_width=True)
+with col_refresh:
+    refresh_btn = st.button("Force refresh", use_container_width=True, help="Bypass the cache and re-fetch from QuickFS")
 
 if "data_loaded" not in st.session_state:
     st.session_state.data_loaded = False
-    st.session_state.raw_df = None
-    st.session_state.ttm_df = None
+    st.session_state.full_df = None
     st.session_state.meta = {}
+    st.session_state.year_options = []
+    st.session_state.period_options = []
 
-if load_btn and ticker:
+if refresh_btn and ticker:
+    # Drop every cache tier for this ticker, then load as usual
+    get_financials.clear(ticker)
+    fetch_quickfs_data.clear(ticker)
+    disk_cache_clear(ticker)
+
+if (load_btn or refresh_btn) and ticker:
     with st.spinner("Fetching data..."):
-        raw, error = fetch_quickfs_data(ticker)
+        full, meta, error = get_financials(ticker)
         if error:
             st.error(error)
             st.session_state.data_loaded = False
         else:
-            df_annual, df_ttm = process_financials(raw)
-            if isinstance(df_annual, pd.DataFrame):
-                st.session_state.raw_df = df_annual
-                st.session_state.ttm_df = df_ttm
-                st.session_state.meta = raw.get("metadata", {})
-                st.session_state.data_loaded = True
-            else:
-                st.error(df_ttm)
-
-if st.session_state.data_loaded:
-    df_main = st.session_state.raw_df
-    df_ttm = st.session_state.ttm_df
+            st.session_state.full_df = full
+            # Selector options materialized once per load, not on every rerun
+            st.session_state.period_options = full.index.tolist()
+            # Start Year never offers TTM, which (if present) is always the last period
+            st.session_state.year_options = [p for p in st.session_state.period_options if p != TTM_PERIOD]
+            st.session_state.meta = meta
+            st.session_state.data_loaded = True
+
+# --- DASHBOARD (fragment: selector changes rerun only this block) ---
+@st.fragment
+def render_dashboard():
+    if not st.session_state.data_loaded: return
+    
+    df_full = st.session_state.full_df
     meta = st.session_state.meta
     
     st.divider()
     
     # TIMEFRAME SELECTOR
-    available_years = list(df_main.index)
-    available_options = available_years.copy()
-    if df_ttm is not None:
-        available_options.append("TTM")
+    available_years = st.session_state.year_options
+    available_options = st.session_state.period_options  # df_full's index: years, then TTM_PERIOD if present
     
     default_end_idx = len(available_options) - 1
     default_start_idx = max(0, default_end_idx - 10)
     
     c1, c2, c3 = st.columns([1, 1, 2])
     with c1:
-        start_period = st.selectbox("Start Year", available_years, index=default_start_idx)
+        start_period = st.selectbox("Start Year", available_years, index=default_start_idx, format_func=period_label)
     with c2:
-        valid_end_options = [opt for opt in available_options if opt == "TTM" or opt >= start_period]
+        # Options are sorted ints (TTM_PERIOD last), so one binary search finds the cut
+        start_pos = bisect_left(available_options, start_period)
+        valid_end_options = available_options[start_pos:]
         end_idx = len(valid_end_options)-1 
-        end_period = st.selectbox("End Year", valid_end_options, index=end_idx)
+        end_period = st.selectbox("End Year", valid_end_options, index=end_idx, format_func=period_label)
     
     # FILTERING
-    if end_period == "TTM" and df_ttm is not None:
-        df_combined = pd.concat([df_main, df_ttm])
-        df_slice = df_combined.loc[start_period:].copy() 
-    else:
-        df_slice = df_main.loc[start_period : end_period].copy()
+    # Timeframe changes only re-slice the series assembled at load time;
+    # available_options mirrors df_full's index, so the cut is purely positional
+    end_pos = bisect_left(available_options, end_period, start_pos) + 1
+    df_slice = df_full.iloc[start_pos:end_pos]
 
     # CALCULATIONS
     if len(df_slice) >= 2:
-        df_slice['FCF'] = df_slice['OCF'] - df_slice['CapEx'].abs()
-        # Invested Capital Definition: (Current Assets - Liabilities) + PPE + Goodwill
-        df_slice['IC'] = (df_slice['Current Assets'] - df_slice['Liabilities']) + df_slice['PPE'] + df_slice['Goodwill']
-        
-        start_idx = df_slice.index[0]
-        end_idx = df_slice.index[-1]
-        
-        A1 = df_slice['FCF'].sum()
-        B1 = df_slice.loc[end_idx, 'FCF'] - df_slice.loc[start_idx, 'FCF']
-        A2 = df_slice.loc[end_idx, 'IC'] - df_slice.loc[start_idx, 'IC']
+        # FCF/IC were derived once at load; a timeframe change only reduces the slice
+        fcf, ic = np.ascontiguousarray(df_slice[["FCF", "IC"]].to_numpy().T)
+        # nansum in the kernel matches Series.sum() skipping missing years
+        A1, B1, A2, roiic, reinvest, score = compounder_kernel(fcf, ic)
         
-        roiic = B1 / A2 if A2 != 0 else 0
-        reinvest = A2 / A1 if A1 != 0 else 0
-        score = roiic * reinvest
+        start_idx = period_label(df_slice.index[0])
+        end_idx = period_label(df_slice.index[-1])
         
         # Verdict Styling
-        if reinvest < 0.20: 
-            v_txt, v_bg, v_col = "Cash Cow", colors['warning_bg'], colors['warning_text']
-        elif 0.80 <= reinvest <= 1.00: 
-            v_txt, v_bg, v_col = "Aggressive Compounder", colors['success_bg'], colors['success_text']
-        elif reinvest > 1.00: 
-            v_txt, v_bg, v_col = "External Funding (>100%)", colors['error_bg'], colors['error_text']
-        else: 
-            v_txt, v_bg, v_col = "Moderate Reinvestment", colors['blue_bg'], colors['blue_text']
+        v_txt, v_bg_key, v_col_key = VERDICTS[bisect_right(VERDICT_BOUNDS, reinvest)]
+        v_bg, v_col = colors[v_bg_key], colors[v_col_key]
 
         st.subheader(f"{meta.get('name', ticker)} Analysis ({start_idx} - {end_idx})")
         
@@ -858,27 +655,13 @@ if st.session_state.data_loaded:
             ), unsafe_allow_html=True)
         
         # HTML Table with Dynamic Colors
-        table_html = f"""
-        <table>
-            <thead><tr><th>Metric</th><th>Value</th><th>Formula</th><th>Label</th></tr></thead>
-            <tbody>
-                <tr><td><b>Accumulated FCF</b></td><td>{format_currency(A1)}</td><td>∑ FCF</td><td><b>A1</b></td></tr>
-                <tr><td><b>Increase in FCF</b></td><td>{format_currency(B1)}</td><td>FCF<sub>end</sub> - FCF<sub>start</sub></td><td><b>B1</b></td></tr>
-                <tr><td><b>Increase in IC</b></td><td>{format_currency(A2)}</td><td>IC<sub>end</sub> - IC<sub>start</sub></td><td><b>A2</b></td></tr>
-                <tr><td><b>ROIIC</b></td><td>{roiic:.1%}</td><td>B1 / A2</td><td><b>C1</b></td></tr>
-                <tr><td><b>Reinvestment Rate</b></td><td>{reinvest:.1%}</td><td>A2 / A1</td><td><b>C2</b></td></tr>
-                <tr style="background-color:{colors['surface_high']}"><td><b>Final Score</b></td><td>{score:.1%}</td><td>C1 × C2</td><td><b>Result</b></td></tr>
-            </tbody>
-        </table>
-        """
-        st.markdown(table_html, unsafe_allow_html=True)
+        st.markdown(RESULTS_TABLE_TEMPLATE.format_map({
+            "A1": format_currency(A1), "B1": format_currency(B1), "A2": format_currency(A2),
+            "roiic": f"{roiic:.1%}", "reinvest": f"{reinvest:.1%}", "score": f"{score:.1%}",
+            "surface_high": colors['surface_high'],
+        }), unsafe_allow_html=True)
         
-        st.markdown(f"""
-        <div class="verdict-box" style="background-color:{v_bg}; border-color:{v_bg};">
-            <span style="font-size:1.2rem;">🧬</span>
-            <span style="color:{v_col}; font-weight:700;">Phase: {v_txt}</span>
-        </div>
-        """, unsafe_allow_html=True)
+        st.markdown(VERDICT_TEMPLATE.format_map({"bg": v_bg, "color": v_col, "text": v_txt}), unsafe_allow_html=True)
         
         st.write("")
         st.write("")
@@ -895,24 +678,34 @@ if st.session_state.data_loaded:
             <br><br>
             """, unsafe_allow_html=True)
             
-            # Prepare display DF (remove 'Assets' sum column, add individual components)
-            df_display = df_slice.copy()
-            df_display = df_display.rename(columns={
-                "OCF": "Operating Cash Flow",
-                "Liabilities": "Total Current Liabilities",
-                "PPE": "PPE (net)",
-                "Current Assets": "Total Current Assets"
-            })
+            # Same lazy pattern as the guide: skip building the table while nobody looks at it
+            if st.toggle("Show table", key="data_shown"):
+                # Prepare display DF (remove 'Assets' sum column, add individual components)
+                # rename() returns a new frame, so the shared slice is never mutated
+                df_display = df_slice.rename(index=period_label, columns={
+                    "OCF": "Operating Cash Flow",
+                    "Liabilities": "Total Current Liabilities",
+                    "PPE": "PPE (net)",
+                    "Current Assets": "Total Current Assets"
+                })
             
-            # Select and reorder columns for clarity
-            cols_to_show = ["Operating Cash Flow", "CapEx", "Total Current Assets", "Total Current Liabilities", "PPE (net)", "Goodwill", "FCF", "IC"]
-            # Ensure columns exist (FCF/IC added in main logic)
-            cols = [c for c in cols_to_show if c in df_display.columns]
+                # Select and reorder columns for clarity
+                cols_to_show = ["Operating Cash Flow", "CapEx", "Total Current Assets", "Total Current Liabilities", "PPE (net)", "Goodwill", "FCF", "IC"]
+                # Ensure columns exist (FCF/IC are derived at load)
+                cols = [c for c in cols_to_show if c in df_display.columns]
             
-            st.dataframe(df_display[cols].style.format("{:,.0f}"))
+                # Numbers stay numeric (sortable) and are formatted client-side, no Styler/Jinja pass
+                st.dataframe(df_display[cols], column_config={
+                    c: st.column_config.NumberColumn(format="%,.0f") for c in cols
+                })
         
         with st.expander("The Compounder Formula Guide"):
-            components.html(html_guide, height=2000, scrolling=True)
+            # Expander bodies run even when collapsed; only ship the guide once asked for
+            if st.toggle("Show guide", key="guide_shown"):
+                import streamlit.components.v1 as components
+                components.html(load_guide(), height=2000, scrolling=True)
             
     else:
         st.warning("Select a range with at least 2 periods.")
+
+render_dashboard()